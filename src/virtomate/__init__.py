@@ -4,7 +4,7 @@ import json
 import logging
 import sys
 import typing
-from collections.abc import Generator
+from collections.abc import Generator, Sequence
 from contextlib import contextmanager
 from typing import TypedDict
 
@@ -161,13 +161,13 @@ def _import_volume(args: argparse.Namespace) -> int:
 
 
 def _handle_exception(
-    ex: BaseException, output: typing.IO[str] = sys.stdout, pretty: bool = False
+    ex: BaseException, output: typing.IO[str] | None = None, pretty: bool = False
 ) -> int:
     """Handle the given exception by converting it into JSON and printing it to ``output``.
 
     Args:
         ex: exception to handle
-        output: file-like object the exception will be written to
+        output: file-like object the exception will be written to, :py:data:`sys.stdout` if ``None``
 
     Returns:
         exit code to be passed to :py:func:`sys.exit`
@@ -190,15 +190,28 @@ def _configure_logging(args: argparse.Namespace) -> None:
 
 
 def _print_json(
-    result: typing.Any, output: typing.IO[str] = sys.stdout, pretty: bool = False
+    result: typing.Any, output: typing.IO[str] | None = None, pretty: bool = False
 ) -> None:
+    # Resolve sys.stdout on every call instead of binding it as default argument. Otherwise, output could not be
+    # redirected when main() is invoked in-process.
+    if output is None:
+        output = sys.stdout
+
     indent = 2 if pretty else None
     separators = (",", ": ") if pretty else (",", ":")
     json.dump(result, output, indent=indent, separators=separators, sort_keys=True)
 
 
-def main() -> int:
-    p = argparse.ArgumentParser(description="Automate libvirt.")
+def main(argv: Sequence[str] | None = None) -> int:
+    """Run virtomate with the given command line arguments and return its exit code.
+
+    Args:
+        argv: command line arguments without the program name, :py:data:`sys.argv` if ``None``
+
+    Returns:
+        exit code to be passed to :py:func:`sys.exit`
+    """
+    p = argparse.ArgumentParser(prog="virtomate", description="Automate libvirt.")
     p.add_argument(
         "-v",
         "--version",
@@ -355,7 +368,7 @@ def main() -> int:
     )
     p_volume_import.set_defaults(func=_import_volume)
 
-    args = p.parse_args()
+    args = p.parse_args(argv)
     try:
         _configure_logging(args)
         logger.debug("Recognised arguments: %s", args)
@@ -69,11 +69,13 @@ def list_volumes(conn: virConnect, pool_name: str) -> Iterable[VolumeDescriptor]
         List of volumes
     """
 
-    if not pool_exists(conn, pool_name):
-        raise NotFoundError(f"Pool '{pool_name}' does not exist")
+    # Look up the pool only once. The lookup doubles as an existence check.
+    try:
+        pool = conn.storagePoolLookupByName(pool_name)
+    except libvirt.libvirtError as ex:
+        raise NotFoundError(f"Pool '{pool_name}' does not exist") from ex
 
     volumes = []
-    pool = conn.storagePoolLookupByName(pool_name)
 
     # A refresh gets rid of orphaned volumes that have been deleted without involvement of libvirt.
     pool.refresh(0)
@@ -0,0 +1,53 @@
+"""Runs virtomate in-process like a command line program."""
+
+import io
+import logging
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import dataclass
+from unittest import mock
+
+import virtomate
+
+
+@dataclass
+class CompletedRun:
+    """Outcome of an in-process invocation of virtomate, modelled after :py:class:`subprocess.CompletedProcess`."""
+
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+def run_virtomate(*args: str, input: str = "") -> CompletedRun:
+    """Run virtomate with the given command line arguments in-process and capture its exit code, standard output and
+    standard error. ``input`` is passed to virtomate as standard input.
+
+    This avoids spawning a new Python interpreter and importing libvirt over and over again for every invocation."""
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    stdin = io.TextIOWrapper(io.BytesIO(input.encode()))
+
+    # virtomate reconfigures the root logger. Restore its configuration afterward so that tests do not interfere
+    # with each other or pytest's log capturing.
+    root_logger = logging.getLogger()
+    handlers = root_logger.handlers[:]
+    level = root_logger.level
+
+    try:
+        with (
+            mock.patch.object(sys, "stdin", stdin),
+            redirect_stdout(stdout),
+            redirect_stderr(stderr),
+        ):
+            try:
+                returncode = virtomate.main(args)
+            except SystemExit as ex:
+                # argparse exits on usage errors and after printing help or the version.
+                assert isinstance(ex.code, int)
+                returncode = ex.code
+    finally:
+        root_logger.handlers[:] = handlers
+        root_logger.setLevel(level)
+
+    return CompletedRun(returncode, stdout.getvalue(), stderr.getvalue())
@@ -1,10 +1,17 @@
+import threading
 from collections.abc import Generator
+from typing import Any
 
 import libvirt
 from libvirt import virConnect
 import pytest
 
-from tests.resources import fixture
+from tests.domains import (
+    define_simple_bios_raw_vm,
+    define_simple_bios_vm,
+    define_simple_uefi_vm,
+)
+from tests.virsh import Virsh
 from virtomate import connect
 
 
@@ -47,18 +54,79 @@ def test_connection() -> Generator[virConnect, None, None]:
         yield conn
 
 
-@pytest.fixture
-def conn() -> Generator[virConnect, None, None]:
-    with connect() as conn:
+@pytest.fixture(scope="module")
+def test_connection_for_module() -> Generator[virConnect, None, None]:
+    """Like ``test_connection`` but shared by all tests of a module. Tests using it must not modify the state of the
+    test driver.
+
+    The test driver keeps the state of ``test:///default`` for as long as any connection to it is open. Sharing the
+    connection beyond a module would therefore leak state into other modules that expect a pristine test driver."""
+    with connect("test:///default") as conn:
         yield conn
 
 
-@pytest.fixture(scope="class")
-def conn_for_class() -> Generator[virConnect, None, None]:
+@pytest.fixture(scope="session")
+def conn_for_session(libvirt_event_loop: None) -> Generator[virConnect, None, None]:
+    """Connection to the default libvirt instance that is shared by the whole session. It delivers domain events."""
     with connect() as conn:
         yield conn
 
 
+@pytest.fixture(scope="session")
+def libvirt_event_loop() -> None:
+    """Register libvirt's default event loop implementation and run it in a background thread. Only connections opened
+    afterward deliver events like domain lifecycle events."""
+    libvirt.virEventRegisterDefaultImpl()
+
+    def run() -> None:
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    threading.Thread(target=run, name="libvirt-event-loop", daemon=True).start()
+
+
+@pytest.fixture(scope="session")
+def virsh(conn_for_session: virConnect) -> Virsh:
+    return Virsh(conn_for_session)
+
+
+class _SharedConnection:
+    """Wraps a connection that is shared between several users. Closing it does nothing so that the connection stays
+    open for its other users. Everything else is delegated to the wrapped connection."""
+
+    def __init__(self, conn: virConnect):
+        self._conn = conn
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def close(self) -> int:
+        return 0
+
+
+@pytest.fixture(scope="module")
+def shared_virtomate_connection(
+    conn_for_session: virConnect, test_connection_for_module: virConnect
+) -> Generator[None, None, None]:
+    """Make in-process invocations of virtomate reuse the session's connection to the default libvirt instance and the
+    module's connection to ``test:///default`` instead of opening and closing a connection for every invocation.
+    Connections to other URIs are unaffected. Only ``libvirt.open()`` is replaced, so :py:func:`virtomate.connect`
+    still logs and closes as usual."""
+    libvirt_open = libvirt.open
+
+    def shared_open(name: str | None = None) -> Any:
+        if name is None or name == "":
+            return _SharedConnection(conn_for_session)
+        elif name == "test:///default":
+            return _SharedConnection(test_connection_for_module)
+        else:
+            return libvirt_open(name)
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(libvirt, "open", shared_open)
+        yield
+
+
 def _clean_up(conn: virConnect) -> None:
     for name in ["default", "nvram"]:
         pool = conn.storagePoolLookupByName(name)
@@ -86,111 +154,64 @@ def _clean_up(conn: virConnect) -> None:
         domain.undefineFlags(flags)
 
 
-def _simple_bios_vm(conn: virConnect) -> str:
-    vol_xml = """
-    <volume>
-        <name>virtomate-simple-bios</name>
-        <target>
-            <format type='qcow2'/>
-        </target>
-        <backingStore>
-            <path>/var/lib/libvirt/images/simple-bios</path>
-            <format type='qcow2'/>
-        </backingStore>
-    </volume>
-    """
-    pool_default = conn.storagePoolLookupByName("default")
-    pool_default.createXML(vol_xml, 0)
-    conn.defineXML(fixture("simple-bios.xml"))
-
-    return "virtomate-simple-bios"
-
-
 @pytest.fixture
-def simple_bios_vm(conn: virConnect, after_function_cleanup: None) -> str:
-    return _simple_bios_vm(conn)
+def simple_bios_vm(conn_for_session: virConnect, after_function_cleanup: None) -> str:
+    return define_simple_bios_vm(conn_for_session)
 
 
-@pytest.fixture(scope="class")
-def running_vm_for_class(conn_for_class: virConnect, after_class_cleanup: None) -> str:
-    domain_name = _simple_bios_vm(conn_for_class)
-    domain = conn_for_class.lookupByName(domain_name)
-    domain.create()
-    return domain_name
+@pytest.fixture
+def simple_uefi_vm(conn_for_session: virConnect, after_function_cleanup: None) -> str:
+    return define_simple_uefi_vm(conn_for_session)
 
 
-def _simple_uefi_vm(conn: virConnect) -> str:
+@pytest.fixture(scope="session")
+def simple_bios_raw_image(conn_for_session: virConnect) -> Generator[str, None, None]:
+    """Raw copy of the qcow2 image ``simple-bios``, converted once per session. Its name lacks the prefix
+    ``virtomate-`` so that cleaning up after a test does not remove it."""
     vol_xml = """
         <volume>
-            <name>virtomate-simple-uefi</name>
-            <target>
-                <format type='qcow2'/>
-            </target>
-            <backingStore>
-                <path>/var/lib/libvirt/images/simple-uefi</path>
-                <format type='qcow2'/>
-            </backingStore>
-        </volume>
-        """
-
-    nvram_xml = """
-        <volume>
-            <name>virtomate-simple-uefi-efivars.fd</name>
+            <name>simple-bios-raw</name>
             <target>
                 <format type='raw'/>
             </target>
         </volume>
         """
 
-    pool_default = conn.storagePoolLookupByName("default")
-    pool_default.createXML(vol_xml, 0)
-
-    pool_nvram = conn.storagePoolLookupByName("nvram")
-    nvram_vol = conn.storageVolLookupByPath(
-        "/var/lib/libvirt/images/simple-uefi-efivars.fd"
-    )
-    pool_nvram.createXMLFrom(nvram_xml, nvram_vol, 0)
-
-    conn.defineXML(fixture("simple-uefi.xml"))
-
-    return "virtomate-simple-uefi"
+    pool_default = conn_for_session.storagePoolLookupByName("default")
 
+    # A session that has been killed before it could delete the image leaves it behind. Remove it so that it cannot
+    # break all following sessions.
+    try:
+        pool_default.storageVolLookupByName("simple-bios-raw").delete(0)
+    except libvirt.libvirtError:
+        pass
 
-@pytest.fixture
-def simple_uefi_vm(conn: virConnect, after_function_cleanup: None) -> str:
-    return _simple_uefi_vm(conn)
-
-
-def _simple_bios_raw_vm(conn: virConnect) -> str:
-    vol_xml = """
-        <volume>
-            <name>virtomate-simple-bios-raw</name>
-            <target>
-                <format type='raw'/>
-            </target>
-        </volume>
-        """
-
-    pool_default = conn.storagePoolLookupByName("default")
     vol_to_clone = pool_default.storageVolLookupByName("simple-bios")
-    pool_default.createXMLFrom(vol_xml, vol_to_clone, 0)
-    conn.defineXML(fixture("simple-bios-raw.xml"))
-
-    return "virtomate-simple-bios-raw"
+    image = pool_default.createXMLFrom(vol_xml, vol_to_clone, 0)
+    try:
+        yield image.name()
+    finally:
+        image.delete(0)
 
 
 @pytest.fixture
-def simple_bios_raw_vm(conn: virConnect, after_function_cleanup: None) -> str:
-    return _simple_bios_raw_vm(conn)
+def simple_bios_raw_vm(
+    conn_for_session: virConnect,
+    simple_bios_raw_image: str,
+    pytestconfig: pytest.Config,
+    after_function_cleanup: None,
+) -> str:
+    reflink = pytestconfig.getoption("--reflink")
+    return define_simple_bios_raw_vm(conn_for_session, simple_bios_raw_image, reflink)
 
 
 @pytest.fixture
-def after_function_cleanup(conn: virConnect) -> Generator[None, None, None]:
+def after_function_cleanup(conn_for_session: virConnect) -> Generator[None, None, None]:
     yield
-    _clean_up(conn)
+    _clean_up(conn_for_session)
 
 
 @pytest.fixture(scope="class")
-def after_class_cleanup(conn_for_class: virConnect) -> Generator[None, None, None]:
+def after_class_cleanup(conn_for_session: virConnect) -> Generator[None, None, None]:
     yield
-    _clean_up(conn_for_class)
+    _clean_up(conn_for_session)
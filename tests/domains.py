@@ -0,0 +1,90 @@
+"""Domains for the functional tests. Their names start with ``virtomate-`` so that cleaning up after a test removes
+them."""
+
+import libvirt
+from libvirt import virConnect
+
+from tests.resources import fixture
+
+
+def define_simple_bios_vm(conn: virConnect) -> str:
+    """Define the domain ``virtomate-simple-bios`` and its volume. Return the name of the domain."""
+    vol_xml = """
+    <volume>
+        <name>virtomate-simple-bios</name>
+        <target>
+            <format type='qcow2'/>
+        </target>
+        <backingStore>
+            <path>/var/lib/libvirt/images/simple-bios</path>
+            <format type='qcow2'/>
+        </backingStore>
+    </volume>
+    """
+    pool_default = conn.storagePoolLookupByName("default")
+    pool_default.createXML(vol_xml, 0)
+    conn.defineXML(fixture("simple-bios.xml"))
+
+    return "virtomate-simple-bios"
+
+
+def define_simple_uefi_vm(conn: virConnect) -> str:
+    """Define the domain ``virtomate-simple-uefi``, its volume, and its NVRAM. Return the name of the domain."""
+    vol_xml = """
+        <volume>
+            <name>virtomate-simple-uefi</name>
+            <target>
+                <format type='qcow2'/>
+            </target>
+            <backingStore>
+                <path>/var/lib/libvirt/images/simple-uefi</path>
+                <format type='qcow2'/>
+            </backingStore>
+        </volume>
+        """
+
+    nvram_xml = """
+        <volume>
+            <name>virtomate-simple-uefi-efivars.fd</name>
+            <target>
+                <format type='raw'/>
+            </target>
+        </volume>
+        """
+
+    pool_default = conn.storagePoolLookupByName("default")
+    pool_default.createXML(vol_xml, 0)
+
+    pool_nvram = conn.storagePoolLookupByName("nvram")
+    nvram_vol = conn.storageVolLookupByPath(
+        "/var/lib/libvirt/images/simple-uefi-efivars.fd"
+    )
+    pool_nvram.createXMLFrom(nvram_xml, nvram_vol, 0)
+
+    conn.defineXML(fixture("simple-uefi.xml"))
+
+    return "virtomate-simple-uefi"
+
+
+def define_simple_bios_raw_vm(conn: virConnect, image: str, reflink: bool) -> str:
+    """Define the domain ``virtomate-simple-bios-raw`` with a raw volume copied from ``image``. Return the name of
+    the domain."""
+    vol_xml = """
+        <volume>
+            <name>virtomate-simple-bios-raw</name>
+            <target>
+                <format type='raw'/>
+            </target>
+        </volume>
+        """
+
+    # Copying a raw image to a raw volume does not involve a conversion. With reflink support, it does not even copy any
+    # data.
+    flags = libvirt.VIR_STORAGE_VOL_CREATE_REFLINK if reflink else 0
+
+    pool_default = conn.storagePoolLookupByName("default")
+    vol_to_clone = pool_default.storageVolLookupByName(image)
+    pool_default.createXMLFrom(vol_xml, vol_to_clone, flags)
+    conn.defineXML(fixture("simple-bios-raw.xml"))
+
+    return "virtomate-simple-bios-raw"
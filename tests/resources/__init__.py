@@ -1,6 +1,8 @@
+import functools
 import os.path
 
 
+@functools.cache
 def fixture(name: str) -> str:
     """Read and return the contents of the fixture with the given name."""
     path = os.path.join(os.path.dirname(__file__), "fixtures", name)
@@ -8,6 +10,7 @@ def fixture(name: str) -> str:
         return f.read()
 
 
+@functools.cache
 def expectation(name: str) -> str:
     """Read and return the contents of the expectation with the given name."""
     path = os.path.join(os.path.dirname(__file__), "expectations", name)
@@ -3,35 +3,94 @@ import logging
 import os
 import pathlib
 import random
-import string
 import subprocess
-from collections.abc import Sequence
-from xml.etree import ElementTree
-from xml.etree.ElementTree import Element
+import threading
+import time
+from collections.abc import Callable, Iterable, Sequence, Mapping
+from typing import Any, TypeVar
 
+import libvirt
+import libvirt_qemu
 import pytest
-from tenacity import wait_fixed, retry, Retrying, stop_after_delay
+from libvirt import virConnect, virDomain
+from lxml import etree
 import importlib.metadata
+from tests.cli import CompletedRun, run_virtomate
+from tests.domains import define_simple_bios_vm
 from tests.matchers import ANY_STR, ANY_INT
+from tests.virsh import Virsh
 from virtomate.domain import DomainDescriptor
 from virtomate.pool import PoolDescriptor
 from virtomate.volume import VolumeDescriptor
 
+try:
+    # orjson parses the small JSON documents emitted by virtomate considerably faster than the json module.
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
 logger = logging.getLogger(__name__)
 
 if "LIBVIRT_DEFAULT_URI" not in os.environ:
     logger.warning(
         "Environment variable LIBVIRT_DEFAULT_URI undefined, using qemu:///system"
     )
-    os.environ["LIBVIRT_DEFAULT_URI"] = "qemu:///system"
+
+_URI = os.environ.setdefault("LIBVIRT_DEFAULT_URI", "qemu:///system")
+
+_IS_TEST_DRIVER = _URI.startswith("test://")
 
 pytestmark = [
     pytest.mark.functional,
-    pytest.mark.skipif(
-        os.environ["LIBVIRT_DEFAULT_URI"].startswith("test://"),
-        reason="libvirt test driver is not supported",
-    ),
+    # The functional tests share domains and volumes with fixed names. With --dist loadgroup, they run on a single
+    # worker.
+    pytest.mark.xdist_group("functional"),
+    pytest.mark.usefixtures("libvirt_event_loop", "shared_virtomate_connection"),
+    pytest.mark.skipif(_IS_TEST_DRIVER, reason="libvirt test driver is not supported"),
+]
+
+# As of libvirt 10.1, there can be multiple leases per hardware address if the same machine has been defined and
+# undefined multiple times. This is a problem of libvirt as shown by `virsh net-dhcp-leases default`.
+LEASE_INTERFACES = [
+    {
+        "name": ANY_STR,
+        "hwaddr": "52:54:00:3d:0e:bb",
+        "addresses": [{"address": ANY_STR, "prefix": ANY_INT, "type": "IPv4"}],
+    },
+]
+"""Interfaces of a running ``simple_bios_vm`` according to the DHCP leases."""
+
+AGENT_INTERFACES = [
+    {
+        "name": "lo",
+        "hwaddr": "00:00:00:00:00:00",
+        "addresses": [
+            {"address": "127.0.0.1", "prefix": 8, "type": "IPv4"},
+            {"address": "::1", "prefix": 128, "type": "IPv6"},
+        ],
+    },
+    {
+        "name": ANY_STR,
+        "hwaddr": "52:54:00:3d:0e:bb",
+        "addresses": [
+            {"address": ANY_STR, "prefix": ANY_INT, "type": "IPv4"},
+            {"address": ANY_STR, "prefix": ANY_INT, "type": "IPv6"},
+        ],
+    },
+]
+"""Interfaces of a running ``simple_bios_vm`` according to the QEMU Guest Agent."""
+
+ARP_INTERFACES = [
+    {
+        "name": ANY_STR,
+        "hwaddr": "52:54:00:3d:0e:bb",
+        "addresses": [{"address": ANY_STR, "prefix": 0, "type": "IPv4"}],
+    },
 ]
+"""Interfaces of a running ``simple_bios_vm`` according to the host's ARP table."""
+
+VIRTOMATE_VERSION = importlib.metadata.version("virtomate")
+"""Version of virtomate under test, determined once because reading the package metadata is comparatively slow."""
 
 BOOT_TIMEOUT = 60
 """For how many seconds to wait for a guest to boot."""
@@ -39,74 +98,267 @@ BOOT_TIMEOUT = 60
 NETWORK_TIMEOUT = 30
 """For how many seconds to wait for a guest to become online."""
 
+EVENT_RECHECK_INTERVAL = 2
+"""For how many seconds to wait for a domain event before checking whether it has been missed."""
+
+TARGET_FORMAT = etree.XPath("target/format")
+"""Selects the format of a volume in a volume descriptor."""
+
+BACKING_STORE = etree.XPath("backingStore")
+"""Selects the backing store of a volume in a volume descriptor."""
+
+BACKING_STORE_PATH = etree.XPath("backingStore/path")
+"""Selects the path of the backing store of a volume in a volume descriptor."""
+
+BACKING_STORE_FORMAT = etree.XPath("backingStore/format")
+"""Selects the format of the backing store of a volume in a volume descriptor."""
+
+AGENT_CHANNEL_STATE = etree.XPath(
+    "devices/channel/target[@name='org.qemu.guest_agent.0']/@state"
+)
+"""Selects the connection state of the QEMU Guest Agent's channel in a domain descriptor."""
+
+
+def run_json(*args: str) -> Any:
+    """Run virtomate in-process with the given command line arguments, ensure that it succeeded without printing
+    anything to standard error, and return its parsed output."""
+    result = run_virtomate(*args)
+    assert result.returncode == 0, f"{' '.join(args)} failed unexpectedly"
+    assert result.stderr == ""
+    return _loads(result.stdout)
+
+
+_Named = TypeVar("_Named", bound=Mapping[str, Any])
+
+
+def by_name(items: Iterable[_Named]) -> dict[str, _Named]:
+    """Index ``items`` by their name so that they can be looked up without scanning all of them."""
+    return {item["name"]: item for item in items}
+
+
+_T = TypeVar("_T")
+
+
+def poll(check: Callable[[], _T], timeout: float) -> _T:
+    """Call ``check`` until it neither fails an assertion nor raises a :py:class:`libvirt.libvirtError` and return its
+    result. The delay between attempts doubles from 50 milliseconds up to 2 seconds and is extended by up to a quarter
+    at random so that concurrent pollers do not hit libvirt in lockstep. The last pause is shortened to end at the
+    deadline, ``timeout`` seconds from now, where ``check`` gets a final attempt. If that fails too, its error is
+    re-raised."""
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while True:
+        try:
+            return check()
+        except (AssertionError, libvirt.libvirtError):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise
+
+        time.sleep(min(delay + random.uniform(0, delay / 4), remaining))
+        delay = min(delay * 2, 2.0)
+
+
+_ready: dict[tuple[str, int], bool] = {}
+"""Domains that :py:func:`wait_until_running` has already seen running, keyed by name and ID. The value tells whether
+the domain was also connected to a network. libvirt assigns a new ID whenever a domain starts. Therefore, a restarted
+domain or a new domain with the same name never matches an old entry."""
+
 
-@retry(stop=stop_after_delay(BOOT_TIMEOUT), wait=wait_fixed(1))
-def wait_until_running(domain: str) -> None:
-    """Waits until the QEMU Guest Agent of the given domain becomes responsive."""
-    args = ["virtomate", "guest-ping", domain]
-    subprocess.run(args, check=True)
+def wait_until_running(conn: virConnect, domain: str, *, network: bool = False) -> None:
+    """Waits until the QEMU Guest Agent of the given domain, which must have been started already, becomes responsive.
+    If ``network`` is ``True``, also waits until the domain is connected to a network. Both the agent and the network
+    are polled by the same loop so that their waits do not add up. Returns immediately if an earlier call has already
+    observed the same run of the domain to be ready."""
+    timeout = BOOT_TIMEOUT + NETWORK_TIMEOUT if network else BOOT_TIMEOUT
+    deadline = time.monotonic() + timeout
+    dom = conn.lookupByName(domain)
 
+    key = (domain, dom.ID())
+    if key in _ready and (_ready[key] or not network):
+        return
 
-@retry(stop=stop_after_delay(NETWORK_TIMEOUT), wait=wait_fixed(1))
-def wait_for_network(domain: str) -> None:
-    """Waits until the given domain is connected a network."""
-    # Use ARP because this is the method that takes the longest for changes to become visible.
-    args = ["virtomate", "domain-iface-list", "--source", "arp", domain]
-    result = subprocess.run(args, check=True, capture_output=True)
-    assert len(json.loads(result.stdout)) > 0
+    # Let the guest agent announce itself instead of pinging it over and over again. The polling below confirms that it
+    # actually responds. Both share the same deadline.
+    _wait_for_agent(conn, dom, deadline)
 
+    ping = json.dumps({"execute": "guest-ping"})
 
-def start_domain(name: str) -> None:
-    cmd = ["virsh", "start", name]
-    result = subprocess.run(cmd)
-    assert result.returncode == 0, f"Could not start {name}"
+    def check() -> None:
+        # Asking for the state is much cheaper than talking to the QEMU Guest Agent of a domain that is not running.
+        (state, _) = dom.state()
+        assert state == libvirt.VIR_DOMAIN_RUNNING, f"{domain} is not running"
 
+        libvirt_qemu.qemuAgentCommand(dom, ping, 1, 0)
 
-def read_volume_xml(pool: str, volume: str) -> Element:
-    cmd = ["virsh", "vol-dumpxml", "--pool", pool, volume]
-    result = subprocess.run(cmd, check=True, capture_output=True)
-    return ElementTree.fromstring(result.stdout)
+        if network:
+            # Use ARP because this is the method that takes the longest for changes to become visible.
+            src = libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_ARP
+            assert len(dom.interfaceAddresses(src, 0)) > 0
 
+    poll(check, max(deadline - time.monotonic(), 0))
+    _ready[key] = network or _ready.get(key, False)
 
-def list_virtomate_domains() -> Sequence[DomainDescriptor]:
-    cmd = ["virtomate", "domain-list"]
-    result = subprocess.run(cmd, check=True, capture_output=True)
-    domains: Sequence[DomainDescriptor] = json.loads(result.stdout)
-    return [d for d in domains if d["name"].startswith("virtomate")]
+
+def _wait_for_agent(conn: virConnect, dom: virDomain, deadline: float) -> None:
+    """Block until the QEMU Guest Agent of ``dom`` is connected or the monotonic clock reaches ``deadline``."""
+    connected = threading.Event()
+
+    def on_agent_lifecycle(
+        conn: virConnect, dom: virDomain, state: int, reason: int, opaque: Any
+    ) -> None:
+        if state == libvirt.VIR_CONNECT_DOMAIN_EVENT_AGENT_LIFECYCLE_STATE_CONNECTED:
+            connected.set()
+
+    try:
+        callback_id = conn.domainEventRegisterAny(
+            dom, libvirt.VIR_DOMAIN_EVENT_ID_AGENT_LIFECYCLE, on_agent_lifecycle, None
+        )
+    except libvirt.libvirtError:
+        # Without events, polling alone has to detect the agent.
+        return
+
+    try:
+        # Check only after registering the callback. Otherwise, the event could be missed if it occurs in between.
+        # Re-check regularly so that an event that is never delivered does not hold up the caller until the deadline.
+        while not _is_agent_connected(dom):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or connected.wait(min(remaining, EVENT_RECHECK_INTERVAL)):
+                return
+    finally:
+        conn.domainEventDeregisterAny(callback_id)
+
+
+def _is_agent_connected(domain: virDomain) -> bool:
+    """Return whether the QEMU Guest Agent of the running ``domain`` is connected to its channel."""
+    states: list[str] = AGENT_CHANNEL_STATE(etree.fromstring(domain.XMLDesc(0)))
+    return states == ["connected"]
+
+
+@pytest.fixture(scope="class")
+def simple_bios_vm_for_class(
+    conn_for_session: virConnect, after_class_cleanup: None
+) -> str:
+    """Like ``simple_bios_vm`` but shared by all tests of a class. Tests using it must not modify the domain."""
+    return define_simple_bios_vm(conn_for_session)
+
+
+@pytest.fixture(scope="class")
+def running_vm_for_class(
+    conn_for_session: virConnect, after_class_cleanup: None
+) -> str:
+    domain_name = define_simple_bios_vm(conn_for_session)
+    domain = conn_for_session.lookupByName(domain_name)
+    domain.create()
+    return domain_name
+
+
+@pytest.fixture(scope="class")
+def online_vm_for_class(conn_for_session: virConnect, running_vm_for_class: str) -> str:
+    """Like ``running_vm_for_class``, but waits until the domain's QEMU Guest Agent is responsive and the domain is
+    connected to the network. The wait happens only once per class."""
+    wait_until_running(conn_for_session, running_vm_for_class, network=True)
+    return running_vm_for_class
+
+
+def create_raw_image(path: pathlib.Path, size: int) -> None:
+    """Create a sparse raw disk image of ``size`` bytes at ``path`` without spawning ``qemu-img``."""
+    with open(path, "wb") as f:
+        # Like `qemu-img create -f raw`, allocate the first block and leave the rest of the image as a hole.
+        f.write(bytes(4096))
+        f.truncate(size)
+
+
+def empty_raw_volume(name: str) -> VolumeDescriptor:
+    """Return the descriptor of an empty raw volume named ``name`` in the pool ``default``."""
+    return {
+        "allocation": 0,
+        "backing_store": None,
+        "capacity": 0,
+        "key": "/var/lib/libvirt/images/" + name,
+        "name": name,
+        "physical": None,
+        "target": {
+            "format_type": "raw",
+            "path": "/var/lib/libvirt/images/" + name,
+        },
+        "type": "file",
+    }
+
+
+def read_volume_xml(virsh: Virsh, pool: str, volume: str) -> etree._Element:
+    return etree.fromstring(virsh.vol_dumpxml(pool, volume))
+
+
+def find_first(xpath: etree.XPath, element: etree._Element) -> etree._Element | None:
+    """Evaluate the precompiled ``xpath`` on ``element`` and return the first match, if any."""
+    matches = xpath(element)
+    return matches[0] if matches else None
+
+
+def check_linked_clone(
+    conn: virConnect, virsh: Virsh, original_name: str, backing_format: str
+) -> None:
+    """Create a linked clone of ``original_name`` and check that its volume is backed by the volume of the original in
+    the format ``backing_format``. Boots the clone and waits until it is running."""
+    clone_name = "virtomate-clone-linked"
+
+    result = run_virtomate(
+        "domain-clone", "--mode", "linked", original_name, clone_name
+    )
+    assert result.returncode == 0, "domain-clone failed unexpectedly"
+    assert result.stdout == ""
+    assert result.stderr == ""
+
+    # Boot the clone while inspecting its volume.
+    virsh.start(clone_name)
+
+    volume_tag = read_volume_xml(virsh, "default", f"{clone_name}-{original_name}")
+    format_tag = find_first(TARGET_FORMAT, volume_tag)
+    bs_path_tag = find_first(BACKING_STORE_PATH, volume_tag)
+    bs_format_tag = find_first(BACKING_STORE_FORMAT, volume_tag)
+
+    assert format_tag is not None
+    assert format_tag.attrib["type"] == "qcow2"
+    assert bs_path_tag is not None
+    assert bs_path_tag.text == f"/var/lib/libvirt/images/{original_name}"
+    assert bs_format_tag is not None
+    assert bs_format_tag.attrib["type"] == backing_format
+
+    wait_until_running(conn, clone_name)
+
+
+def list_virtomate_domains() -> Mapping[str, DomainDescriptor]:
+    domains: list[DomainDescriptor] = run_json("domain-list")
+    return by_name(d for d in domains if d["name"].startswith("virtomate"))
 
 
 def list_virtomate_volumes(pool: str) -> Sequence[VolumeDescriptor]:
-    cmd = ["virtomate", "volume-list", pool]
-    result = subprocess.run(cmd, check=True, text=True, capture_output=True)
-    volumes: Sequence[VolumeDescriptor] = json.loads(result.stdout)
+    volumes: list[VolumeDescriptor] = run_json("volume-list", pool)
     return [v for v in volumes if v["name"].startswith("virtomate")]
 
 
 class TestHelp:
     def test_short_form(self) -> None:
-        cmd = ["virtomate", "-h"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("-h")
         assert result.returncode == 0, "help failed unexpectedly"
         assert "usage: virtomate" in result.stdout
         assert result.stderr == ""
 
     def test_long_form(self) -> None:
-        cmd = ["virtomate", "--help"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("--help")
         assert result.returncode == 0, "help failed unexpectedly"
         assert "usage: virtomate" in result.stdout
         assert result.stderr == ""
 
     def test_usage_errors(self) -> None:
-        cmd = ["virtomate", "unknown-command"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("unknown-command")
         assert result.returncode == 2, "unknown-command succeeded unexpectedly"
         assert result.stdout == ""
         assert "usage: virtomate" in result.stderr
 
     def test_missing_subcommand_raises_usage(self) -> None:
-        cmd = ["virtomate"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate()
         assert result.returncode == 2, "command succeeded unexpectedly"
         assert result.stdout == ""
         assert "usage: virtomate" in result.stderr
@@ -114,101 +366,67 @@ class TestHelp:
 
 class TestLogging:
     def test_no_logging_by_default(self) -> None:
-        cmd = ["virtomate", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("domain-list")
         assert result.returncode == 0, "domain-list failed unexpectedly"
 
-        domains: Sequence[DomainDescriptor] = json.loads(result.stdout)
+        domains: Sequence[DomainDescriptor] = _loads(result.stdout)
         virtomate_domains = [d for d in domains if d["name"].startswith("virtomate")]
         assert virtomate_domains == []
 
         assert result.stderr == ""
 
     def test_short_form(self) -> None:
-        cmd = ["virtomate", "-l", "debug", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("-l", "debug", "domain-list")
         assert result.returncode == 0, "domain-list failed unexpectedly"
 
-        domains: Sequence[DomainDescriptor] = json.loads(result.stdout)
+        domains: Sequence[DomainDescriptor] = _loads(result.stdout)
         virtomate_domains = [d for d in domains if d["name"].startswith("virtomate")]
         assert virtomate_domains == []
 
         assert "INFO:virtomate:Connecting to" in result.stderr
 
     def test_long_form(self) -> None:
-        cmd = ["virtomate", "--log", "info", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("--log", "info", "domain-list")
         assert result.returncode == 0, "domain-list failed unexpectedly"
 
-        domains: Sequence[DomainDescriptor] = json.loads(result.stdout)
+        domains: Sequence[DomainDescriptor] = _loads(result.stdout)
         virtomate_domains = [d for d in domains if d["name"].startswith("virtomate")]
         assert virtomate_domains == []
 
         assert "INFO:virtomate:Connecting to" in result.stderr
 
     def test_error_when_level_is_invalid(self) -> None:
-        cmd = ["virtomate", "--log", "invalid", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("--log", "invalid", "domain-list")
         assert result.returncode == 2, "domain-list succeeded unexpectedly"
         assert result.stdout == ""
         assert "usage: virtomate" in result.stderr
 
 
 class TestVersionOption:
-    def test_short_form(self) -> None:
-        cmd = ["virtomate", "-v"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        assert result.returncode == 0, "version failed unexpectedly"
-        assert result.stdout.strip() != ""
-        assert result.stdout.strip() == importlib.metadata.version("virtomate")
-        assert result.stderr == ""
-
-    def test_long_form(self) -> None:
-        cmd = ["virtomate", "--version"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+    @pytest.mark.parametrize("flag", ["-v", "--version"])
+    def test_version(self, flag: str) -> None:
+        result = run_virtomate(flag)
         assert result.returncode == 0, "version failed unexpectedly"
         assert result.stdout.strip() != ""
-        assert result.stdout.strip() == importlib.metadata.version("virtomate")
+        assert result.stdout.strip() == VIRTOMATE_VERSION
         assert result.stderr == ""
 
 
 class TestConnectionOption:
-    def test_default(self, simple_bios_vm: str) -> None:
-        cmd = ["virtomate", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True)
-        assert result.returncode == 0, "domain-list failed unexpectedly"
-        assert result.stderr == b""
-
-        domains = json.loads(result.stdout)
+    def test_default(self, simple_bios_vm_for_class: str) -> None:
+        domains = by_name(run_json("domain-list"))
 
-        machine = next(d for d in domains if d["name"] == simple_bios_vm)
-        assert machine == {
+        assert domains[simple_bios_vm_for_class] == {
             "uuid": "d2ecf360-24a6-4952-95fb-68b99307d942",
-            "name": simple_bios_vm,
+            "name": simple_bios_vm_for_class,
             "state": "shut-off",
         }
 
-    def test_short_form(self, simple_bios_vm: str) -> None:
-        cmd = ["virtomate", "-c", "test:///default", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True)
-        assert result.returncode == 0, "domain-list failed unexpectedly"
-        assert result.stderr == b""
-
-        domains = json.loads(result.stdout)
-
-        with pytest.raises(StopIteration):
-            next(d for d in domains if d["name"] == simple_bios_vm)
-
-    def test_long_form(self, simple_bios_vm: str) -> None:
-        cmd = ["virtomate", "--connection", "test:///default", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True)
-        assert result.returncode == 0, "domain-list failed unexpectedly"
-        assert result.stderr == b""
-
-        domains = json.loads(result.stdout)
+    @pytest.mark.parametrize("flag", ["-c", "--connection"])
+    def test_override(self, flag: str, simple_bios_vm_for_class: str) -> None:
+        domains = by_name(run_json(flag, "test:///default", "domain-list"))
 
-        with pytest.raises(StopIteration):
-            next(d for d in domains if d["name"] == simple_bios_vm)
+        assert simple_bios_vm_for_class not in domains
 
 
 class TestPrettyOption:
@@ -226,8 +444,7 @@ class TestPrettyOption:
     }
 
     def test_default_not_pretty(self) -> None:
-        cmd = ["virtomate", "-c", "test:///default", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("-c", "test:///default", "domain-list")
         assert result.returncode == 0, "domain-list failed unexpectedly"
         assert result.stdout.strip() == json.dumps(
             self.expected,
@@ -238,8 +455,7 @@ class TestPrettyOption:
         assert result.stderr == ""
 
     def test_short_form(self) -> None:
-        cmd = ["virtomate", "-c", "test:///default", "-p", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("-c", "test:///default", "-p", "domain-list")
         assert result.returncode == 0, "domain-list failed unexpectedly"
         assert result.stdout == json.dumps(
             self.expected, indent=2, separators=(",", ": "), sort_keys=True
@@ -247,14 +463,7 @@ class TestPrettyOption:
         assert result.stderr == ""
 
     def test_long_form(self) -> None:
-        cmd = [
-            "virtomate",
-            "-c",
-            "test:///default",
-            "--pretty",
-            "domain-list",
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("-c", "test:///default", "--pretty", "domain-list")
         assert result.returncode == 0, "domain-list failed unexpectedly"
         assert result.stdout == json.dumps(
             self.expected, indent=2, separators=(",", ": "), sort_keys=True
@@ -262,8 +471,7 @@ class TestPrettyOption:
         assert result.stderr == ""
 
     def test_error_default_not_pretty(self) -> None:
-        cmd = ["virtomate", "-c", "test:///default", "guest-ping", "unknown"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("-c", "test:///default", "guest-ping", "unknown")
         assert result.returncode == 1, "guest-ping succeeded unexpectedly"
         assert result.stdout.strip() == json.dumps(
             self.expected_error,
@@ -274,8 +482,7 @@ class TestPrettyOption:
         assert result.stderr == ""
 
     def test_error_short_form(self) -> None:
-        cmd = ["virtomate", "-c", "test:///default", "-p", "guest-ping", "unknown"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("-c", "test:///default", "-p", "guest-ping", "unknown")
         assert result.returncode == 1, "guest-ping succeeded unexpectedly"
         assert result.stdout.strip() == json.dumps(
             self.expected_error, indent=2, separators=(",", ": "), sort_keys=True
@@ -283,15 +490,9 @@ class TestPrettyOption:
         assert result.stderr == ""
 
     def test_error_long_form(self) -> None:
-        cmd = [
-            "virtomate",
-            "-c",
-            "test:///default",
-            "--pretty",
-            "guest-ping",
-            "unknown",
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate(
+            "-c", "test:///default", "--pretty", "guest-ping", "unknown"
+        )
         assert result.returncode == 1, "guest-ping succeeded unexpectedly"
         assert result.stdout.strip() == json.dumps(
             self.expected_error, indent=2, separators=(",", ": "), sort_keys=True
@@ -301,25 +502,18 @@ class TestPrettyOption:
 
 class TestDomainList:
     def test_list(self, simple_bios_vm: str, simple_uefi_vm: str) -> None:
-        cmd = ["virtomate", "domain-list"]
-        result = subprocess.run(cmd, capture_output=True)
-        assert result.returncode == 0, "domain-list failed unexpectedly"
-        assert result.stderr == b""
-
-        domains = json.loads(result.stdout)
+        domains = by_name(run_json("domain-list"))
 
         # There might be pre-existing domains.
         assert len(domains) >= 2
 
-        machine = next(d for d in domains if d["name"] == simple_bios_vm)
-        assert machine == {
+        assert domains[simple_bios_vm] == {
             "uuid": "d2ecf360-24a6-4952-95fb-68b99307d942",
             "name": simple_bios_vm,
             "state": "shut-off",
         }
 
-        machine = next(d for d in domains if d["name"] == simple_uefi_vm)
-        assert machine == {
+        assert domains[simple_uefi_vm] == {
             "uuid": "ef70b4c0-1773-44a3-9b95-f239ae97d9db",
             "name": simple_uefi_vm,
             "state": "shut-off",
@@ -328,284 +522,143 @@ class TestDomainList:
 
 class TestDomainIfaceList:
     def test_error_when_domain_does_not_exist(self) -> None:
-        cmd = ["virtomate", "domain-iface-list", "unknown"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("domain-iface-list", "unknown")
         assert result.returncode == 1, "domain-iface-list succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "NotFoundError",
             "message": "Domain 'unknown' does not exist",
         }
         assert result.stderr == ""
 
     def test_error_when_domain_off(self, simple_bios_vm: str) -> None:
-        cmd = ["virtomate", "domain-iface-list", simple_bios_vm]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("domain-iface-list", simple_bios_vm)
         assert result.returncode == 1, "domain-iface-list succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "IllegalStateError",
             "message": f"Domain '{simple_bios_vm}' is not running",
         }
         assert result.stderr == ""
 
-    def test_default_source(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
-        wait_for_network(running_vm_for_class)
-
-        # Default is lease (same as of `virsh domifaddr`)
-        cmd = ["virtomate", "domain-iface-list", running_vm_for_class]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        assert result.returncode == 0, "domain-iface-list failed unexpectedly"
-        assert result.stderr == ""
-
-        # As of libvirt 10.1, there can be multiple leases per hardware address if the same machine has been defined and
-        # undefined multiple times. This is a problem of libvirt as shown by `virsh net-dhcp-leases default`.
-        interfaces = json.loads(result.stdout)
-        assert interfaces == [
-            {
-                "name": ANY_STR,
-                "hwaddr": "52:54:00:3d:0e:bb",
-                "addresses": [{"address": ANY_STR, "prefix": ANY_INT, "type": "IPv4"}],
-            },
-        ]
-
-    def test_source_lease(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
-        wait_for_network(running_vm_for_class)
-
-        cmd = [
-            "virtomate",
-            "domain-iface-list",
-            "--source",
-            "lease",
-            running_vm_for_class,
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        assert result.returncode == 0, "domain-iface-list failed unexpectedly"
-        assert result.stderr == ""
-
-        interfaces = json.loads(result.stdout)
-        assert interfaces == [
-            {
-                "name": ANY_STR,
-                "hwaddr": "52:54:00:3d:0e:bb",
-                "addresses": [{"address": ANY_STR, "prefix": ANY_INT, "type": "IPv4"}],
-            },
-        ]
-
-    def test_source_agent(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
-        wait_for_network(running_vm_for_class)
-
-        cmd = [
-            "virtomate",
-            "domain-iface-list",
-            "--source",
-            "agent",
-            running_vm_for_class,
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        assert result.returncode == 0, "domain-iface-list failed unexpectedly"
-        assert result.stderr == ""
-
-        interfaces = json.loads(result.stdout)
-        assert interfaces == [
-            {
-                "name": "lo",
-                "hwaddr": "00:00:00:00:00:00",
-                "addresses": [
-                    {"address": "127.0.0.1", "prefix": 8, "type": "IPv4"},
-                    {"address": "::1", "prefix": 128, "type": "IPv6"},
-                ],
-            },
-            {
-                "name": ANY_STR,
-                "hwaddr": "52:54:00:3d:0e:bb",
-                "addresses": [
-                    {"address": ANY_STR, "prefix": ANY_INT, "type": "IPv4"},
-                    {"address": ANY_STR, "prefix": ANY_INT, "type": "IPv6"},
-                ],
-            },
-        ]
-
-    def test_source_arp(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
-        wait_for_network(running_vm_for_class)
-
-        cmd = [
-            "virtomate",
-            "domain-iface-list",
-            "--source",
-            "arp",
-            running_vm_for_class,
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        assert result.returncode == 0, "domain-iface-list failed unexpectedly"
-        assert result.stderr == ""
+    @pytest.mark.parametrize(
+        "source,expected",
+        [
+            # Default is lease (same as of `virsh domifaddr`)
+            (None, LEASE_INTERFACES),
+            ("lease", LEASE_INTERFACES),
+            ("agent", AGENT_INTERFACES),
+            ("arp", ARP_INTERFACES),
+        ],
+        ids=["default", "lease", "agent", "arp"],
+    )
+    def test_source(
+        self, source: str | None, expected: list[Any], online_vm_for_class: str
+    ) -> None:
+        args = ["domain-iface-list"]
+        if source is not None:
+            args += ["--source", source]
 
-        interfaces = json.loads(result.stdout)
-        assert interfaces == [
-            {
-                "name": ANY_STR,
-                "hwaddr": "52:54:00:3d:0e:bb",
-                "addresses": [{"address": ANY_STR, "prefix": 0, "type": "IPv4"}],
-            },
-        ]
+        assert run_json(*args, online_vm_for_class) == expected
 
 
 class TestDomainClone:
     def test_error_if_domain_to_clone_does_not_exist(self) -> None:
         clone_name = "virtomate-clone-copy"
 
-        cmd = ["virtomate", "domain-clone", "does-not-exist", clone_name]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("domain-clone", "does-not-exist", clone_name)
         assert result.returncode == 1, "domain-clone succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "NotFoundError",
             "message": "Domain 'does-not-exist' does not exist",
         }
         assert result.stderr == ""
 
     def test_error_if_clone_already_exists(self, simple_bios_vm: str) -> None:
-        cmd = ["virtomate", "domain-clone", simple_bios_vm, simple_bios_vm]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("domain-clone", simple_bios_vm, simple_bios_vm)
         assert result.returncode == 1, "domain-clone succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "Conflict",
             "message": f"Domain '{simple_bios_vm}' exists already",
         }
         assert result.stderr == ""
 
-    def test_error_if_original_not_shut_off(self, simple_bios_vm: str) -> None:
+    def test_error_if_original_not_shut_off(
+        self, simple_bios_vm: str, virsh: Virsh, conn_for_session: virConnect
+    ) -> None:
         clone_name = "virtomate-clone-copy"
 
-        start_domain(simple_bios_vm)
-        wait_until_running(simple_bios_vm)
+        virsh.start(simple_bios_vm)
+        wait_until_running(conn_for_session, simple_bios_vm)
 
-        cmd = ["virtomate", "domain-clone", simple_bios_vm, clone_name]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("domain-clone", simple_bios_vm, clone_name)
         assert result.returncode == 1, "domain-clone succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "IllegalStateError",
             "message": f"Domain '{simple_bios_vm}' must be shut off to be cloned",
         }
         assert result.stderr == ""
 
-    def test_copy(self, simple_bios_vm: str) -> None:
+    def test_copy(
+        self, simple_bios_vm: str, virsh: Virsh, conn_for_session: virConnect
+    ) -> None:
         clone_name = "virtomate-clone-copy"
 
-        cmd = ["virtomate", "domain-clone", simple_bios_vm, clone_name]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("domain-clone", simple_bios_vm, clone_name)
         assert result.returncode == 0, "domain-clone failed unexpectedly"
         assert result.stdout == ""
         assert result.stderr == ""
 
-        volume_tag = read_volume_xml(
-            "default", "virtomate-clone-copy-virtomate-simple-bios"
-        )
-        format_tag = volume_tag.find("target/format")
-        assert format_tag is not None
-        assert format_tag.attrib["type"] == "qcow2"
-        assert volume_tag.find("backingStore") is None
-
-        start_domain(clone_name)
-        wait_until_running(clone_name)
-
-    def test_linked_with_qcow2_backing_store(self, simple_bios_vm: str) -> None:
-        clone_name = "virtomate-clone-linked"
-
-        cmd = [
-            "virtomate",
-            "domain-clone",
-            "--mode",
-            "linked",
-            simple_bios_vm,
-            clone_name,
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        assert result.returncode == 0, "domain-clone failed unexpectedly"
-        assert result.stdout == ""
-        assert result.stderr == ""
+        # Boot the clone while inspecting its volume.
+        virsh.start(clone_name)
 
         volume_tag = read_volume_xml(
-            "default", "virtomate-clone-linked-virtomate-simple-bios"
+            virsh, "default", "virtomate-clone-copy-virtomate-simple-bios"
         )
-        format_tag = volume_tag.find("target/format")
-        bs_path_tag = volume_tag.find("backingStore/path")
-        bs_format_tag = volume_tag.find("backingStore/format")
-
+        format_tag = find_first(TARGET_FORMAT, volume_tag)
         assert format_tag is not None
         assert format_tag.attrib["type"] == "qcow2"
-        assert bs_path_tag is not None
-        assert bs_path_tag.text == "/var/lib/libvirt/images/virtomate-simple-bios"
-        assert bs_format_tag is not None
-        assert bs_format_tag.attrib["type"] == "qcow2"
-
-        start_domain(clone_name)
-        wait_until_running(clone_name)
+        assert find_first(BACKING_STORE, volume_tag) is None
 
-    def test_linked_with_raw_backing_store(self, simple_bios_raw_vm: str) -> None:
-        clone_name = "virtomate-clone-linked"
-
-        cmd = [
-            "virtomate",
-            "domain-clone",
-            "--mode",
-            "linked",
-            simple_bios_raw_vm,
-            clone_name,
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        assert result.returncode == 0, "domain-clone failed unexpectedly"
-        assert result.stdout == ""
-        assert result.stderr == ""
-
-        volume_tag = read_volume_xml(
-            "default", "virtomate-clone-linked-virtomate-simple-bios-raw"
-        )
-        format_tag = volume_tag.find("target/format")
-        bs_path_tag = volume_tag.find("backingStore/path")
-        bs_format_tag = volume_tag.find("backingStore/format")
+        wait_until_running(conn_for_session, clone_name)
 
-        assert format_tag is not None
-        assert format_tag.attrib["type"] == "qcow2"
-        assert bs_path_tag is not None
-        assert bs_path_tag.text == "/var/lib/libvirt/images/virtomate-simple-bios-raw"
-        assert bs_format_tag is not None
-        assert bs_format_tag.attrib["type"] == "raw"
+    def test_linked_with_qcow2_backing_store(
+        self, simple_bios_vm: str, virsh: Virsh, conn_for_session: virConnect
+    ) -> None:
+        check_linked_clone(conn_for_session, virsh, simple_bios_vm, "qcow2")
 
-        start_domain(clone_name)
-        wait_until_running(clone_name)
+    def test_linked_with_raw_backing_store(
+        self, simple_bios_raw_vm: str, virsh: Virsh, conn_for_session: virConnect
+    ) -> None:
+        check_linked_clone(conn_for_session, virsh, simple_bios_raw_vm, "raw")
 
-    def test_linked_with_copied_firmware(self, simple_uefi_vm: str) -> None:
+    def test_linked_with_copied_firmware(
+        self, simple_uefi_vm: str, virsh: Virsh, conn_for_session: virConnect
+    ) -> None:
         clone_name = "virtomate-clone-linked"
 
-        cmd = [
-            "virtomate",
-            "domain-clone",
-            "--mode",
-            "linked",
-            simple_uefi_vm,
-            clone_name,
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate(
+            "domain-clone", "--mode", "linked", simple_uefi_vm, clone_name
+        )
         assert result.returncode == 0, "domain-clone failed unexpectedly"
         assert result.stdout == ""
         assert result.stderr == ""
 
+        # Boot the clone while inspecting its volumes.
+        virsh.start(clone_name)
+
         volume_tag = read_volume_xml(
-            "nvram", "virtomate-clone-linked-virtomate-simple-uefi-efivars.fd"
+            virsh, "nvram", "virtomate-clone-linked-virtomate-simple-uefi-efivars.fd"
         )
-        format_tag = volume_tag.find("target/format")
+        format_tag = find_first(TARGET_FORMAT, volume_tag)
         assert format_tag is not None
         assert format_tag.attrib["type"] == "raw"
-        assert volume_tag.find("backingStore") is None
+        assert find_first(BACKING_STORE, volume_tag) is None
 
         volume_tag = read_volume_xml(
-            "default", "virtomate-clone-linked-virtomate-simple-uefi"
+            virsh, "default", "virtomate-clone-linked-virtomate-simple-uefi"
         )
-        format_tag = volume_tag.find("target/format")
-        bs_path_tag = volume_tag.find("backingStore/path")
-        bs_format_tag = volume_tag.find("backingStore/format")
+        format_tag = find_first(TARGET_FORMAT, volume_tag)
+        bs_path_tag = find_first(BACKING_STORE_PATH, volume_tag)
+        bs_format_tag = find_first(BACKING_STORE_FORMAT, volume_tag)
 
         assert format_tag is not None
         assert format_tag.attrib["type"] == "qcow2"
@@ -614,63 +667,54 @@ class TestDomainClone:
         assert bs_format_tag is not None
         assert bs_format_tag.attrib["type"] == "qcow2"
 
-        start_domain(clone_name)
-        wait_until_running(clone_name)
+        wait_until_running(conn_for_session, clone_name)
 
     @pytest.mark.reflink
-    def test_reflink_copy(self, simple_bios_raw_vm: str) -> None:
+    def test_reflink_copy(
+        self, simple_bios_raw_vm: str, virsh: Virsh, conn_for_session: virConnect
+    ) -> None:
         clone_name = "virtomate-clone-reflink"
 
-        cmd = [
-            "virtomate",
-            "domain-clone",
-            "--mode",
-            "reflink",
-            simple_bios_raw_vm,
-            clone_name,
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate(
+            "domain-clone", "--mode", "reflink", simple_bios_raw_vm, clone_name
+        )
         assert result.returncode == 0, "domain-clone failed unexpectedly"
         assert result.stdout == ""
         assert result.stderr == ""
 
+        # Boot the clone while inspecting its volume.
+        virsh.start(clone_name)
+
         # Unfortunately, there is no tool that can tell apart a full from a shallow copy.
         volume_tag = read_volume_xml(
-            "default", "virtomate-clone-reflink-virtomate-simple-bios-raw"
+            virsh, "default", "virtomate-clone-reflink-virtomate-simple-bios-raw"
         )
-        format_tag = volume_tag.find("target/format")
+        format_tag = find_first(TARGET_FORMAT, volume_tag)
         assert format_tag is not None
         assert format_tag.attrib["type"] == "raw"
-        assert volume_tag.find("backingStore") is None
+        assert find_first(BACKING_STORE, volume_tag) is None
 
-        start_domain(clone_name)
-        wait_until_running(clone_name)
+        wait_until_running(conn_for_session, clone_name)
 
-    def test_rollback_if_disk_already_exists(self, simple_uefi_vm: str) -> None:
+    def test_rollback_if_disk_already_exists(
+        self, simple_uefi_vm: str, virsh: Virsh
+    ) -> None:
         clone_name = "virtomate-clone-copy"
         clone_disk_name = "virtomate-clone-copy-virtomate-simple-uefi"
 
         # Create a volume with the same name that is going to be used by `domain-clone` to induce a failure during the
         # clone process.
-        cmd = ["virsh", "vol-create-as", "default", clone_disk_name, "1"]
-        subprocess.run(cmd, check=True)
-
-        cmd = [
-            "virtomate",
-            "domain-clone",
-            simple_uefi_vm,
-            clone_name,
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        virsh.vol_create_as("default", clone_disk_name, 1)
+
+        result = run_virtomate("domain-clone", simple_uefi_vm, clone_name)
         assert result.returncode == 1, "domain-clone succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "libvirtError",
             "message": f"internal error: storage volume name '{clone_disk_name}' already in use.",
         }
         assert result.stderr == ""
 
-        domain_names = [d["name"] for d in list_virtomate_domains()]
-        assert domain_names == [simple_uefi_vm]
+        assert set(list_virtomate_domains()) == {simple_uefi_vm}
 
         vol_names_default = [v["name"] for v in list_virtomate_volumes("default")]
         assert vol_names_default == ["virtomate-simple-uefi"]
@@ -681,40 +725,41 @@ class TestDomainClone:
 
 class TestGuestPing:
     def test_error_unknown_machine(self) -> None:
-        cmd = ["virtomate", "guest-ping", "does-not-exist"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("guest-ping", "does-not-exist")
         assert result.returncode == 1, "guest-ping succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "NotFoundError",
             "message": "Domain 'does-not-exist' does not exist",
         }
         assert result.stderr == ""
 
     def test_error_when_domain_off(self, simple_bios_vm: str) -> None:
-        cmd = ["virtomate", "guest-ping", simple_bios_vm]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("guest-ping", simple_bios_vm)
         assert result.returncode == 125, "guest-ping succeeded unexpectedly"
         # No error because the return code already indicates that the guest could not be reached.
         assert result.stdout == ""
         assert result.stderr == ""
 
-    def test_guest_ping(self, simple_bios_vm: str) -> None:
-        start_domain(simple_bios_vm)
+    def test_guest_ping(self, simple_bios_vm: str, virsh: Virsh) -> None:
+        virsh.start(simple_bios_vm)
 
-        for attempt in Retrying(stop=stop_after_delay(BOOT_TIMEOUT)):
-            with attempt:
-                cmd = ["virtomate", "guest-ping", simple_bios_vm]
-                result = subprocess.run(cmd, capture_output=True, check=True, text=True)
+        def ping() -> CompletedRun:
+            result = run_virtomate("guest-ping", simple_bios_vm)
+            assert result.returncode == 0, f"Could not ping {simple_bios_vm}"
+            return result
 
-        assert result.returncode == 0, f"Could not ping {simple_bios_vm}"
+        result = poll(ping, BOOT_TIMEOUT)
         assert result.stdout == ""
         assert result.stderr == ""
 
-    def test_wait_for_guest_ping_success(self, simple_bios_vm: str) -> None:
-        start_domain(simple_bios_vm)
+    def test_wait_for_guest_ping_success(
+        self, simple_bios_vm: str, virsh: Virsh
+    ) -> None:
+        virsh.start(simple_bios_vm)
 
-        cmd = ["virtomate", "guest-ping", "--wait", str(BOOT_TIMEOUT), simple_bios_vm]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate(
+            "guest-ping", "--wait", str(BOOT_TIMEOUT), simple_bios_vm
+        )
 
         assert result.returncode == 0, "Agent did not respond within timeout"
         assert result.stdout == ""
@@ -723,15 +768,9 @@ class TestGuestPing:
 
 class TestPoolList:
     def test(self) -> None:
-        cmd = ["virtomate", "pool-list"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        assert result.returncode == 0, "pool-list failed unexpectedly"
-        assert result.stderr == ""
-
-        pools: Sequence[PoolDescriptor] = json.loads(result.stdout)
-        virtomate_pool = next(p for p in pools if p["name"] == "default")
+        pools: Mapping[str, PoolDescriptor] = by_name(run_json("pool-list"))
 
-        assert virtomate_pool == {
+        assert pools["default"] == {
             "active": True,
             "allocation": ANY_INT,
             "available": ANY_INT,
@@ -746,40 +785,33 @@ class TestPoolList:
 
 class TestGuestRun:
     def test_error_unknown_domain(self) -> None:
-        cmd = ["virtomate", "guest-run", "does-not-exist", "echo", "Hello World!"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("guest-run", "does-not-exist", "echo", "Hello World!")
         assert result.returncode == 1, "guest-run succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "NotFoundError",
             "message": "Domain 'does-not-exist' does not exist",
         }
         assert result.stderr == ""
 
     def test_error_domain_not_running(self, simple_bios_vm: str) -> None:
-        cmd = ["virtomate", "guest-run", simple_bios_vm, "echo", "Hello World!"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("guest-run", simple_bios_vm, "echo", "Hello World!")
         assert result.returncode == 1, "guest-run succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "IllegalStateError",
             "message": f"Domain '{simple_bios_vm}' is not running",
         }
         assert result.stderr == ""
 
-    def test_hello_world_text(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
+    def test_hello_world_text(
+        self, conn_for_session: virConnect, running_vm_for_class: str
+    ) -> None:
+        wait_until_running(conn_for_session, running_vm_for_class)
 
-        cmd = [
-            "virtomate",
-            "guest-run",
-            running_vm_for_class,
-            "--",
-            "echo",
-            "-n",
-            "Hello World!",
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate(
+            "guest-run", running_vm_for_class, "--", "echo", "-n", "Hello World!"
+        )
         assert result.returncode == 0, "guest-run failed unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "exit_code": 0,
             "signal": None,
             "stdout": "Hello World!",
@@ -789,11 +821,12 @@ class TestGuestRun:
         }
         assert result.stderr == ""
 
-    def test_hello_world_base64(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
+    def test_hello_world_base64(
+        self, conn_for_session: virConnect, running_vm_for_class: str
+    ) -> None:
+        wait_until_running(conn_for_session, running_vm_for_class)
 
-        cmd = [
-            "virtomate",
+        result = run_virtomate(
             "guest-run",
             "--encode",
             running_vm_for_class,
@@ -801,10 +834,9 @@ class TestGuestRun:
             "echo",
             "-n",
             "Hello World!",
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        )
         assert result.returncode == 0, "guest-run failed unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "exit_code": 0,
             "signal": None,
             "stdout": "SGVsbG8gV29ybGQh",  # == Hello World!
@@ -814,13 +846,14 @@ class TestGuestRun:
         }
         assert result.stderr == ""
 
-    def test_run_failure(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
+    def test_run_failure(
+        self, conn_for_session: virConnect, running_vm_for_class: str
+    ) -> None:
+        wait_until_running(conn_for_session, running_vm_for_class)
 
-        cmd = ["virtomate", "guest-run", running_vm_for_class, "cat", "/unknown"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("guest-run", running_vm_for_class, "cat", "/unknown")
         assert result.returncode == 0, "guest-run failed unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "exit_code": 1,
             "signal": None,
             "stdout": None,
@@ -830,23 +863,25 @@ class TestGuestRun:
         }
         assert result.stderr == ""
 
-    def test_error_if_program_unknown(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
+    def test_error_if_program_unknown(
+        self, conn_for_session: virConnect, running_vm_for_class: str
+    ) -> None:
+        wait_until_running(conn_for_session, running_vm_for_class)
 
-        cmd = ["virtomate", "guest-run", running_vm_for_class, "/does/not/exist"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("guest-run", running_vm_for_class, "/does/not/exist")
         assert result.returncode == 1, "guest-run succeeded unexpectedly"
         assert result.stderr == ""
 
-        error = json.loads(result.stdout)
+        error = _loads(result.stdout)
         assert error["type"] == "libvirtError"
         assert "Failed to execute child process" in error["message"]
 
-    def test_bash(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
+    def test_bash(
+        self, conn_for_session: virConnect, running_vm_for_class: str
+    ) -> None:
+        wait_until_running(conn_for_session, running_vm_for_class)
 
-        cmd = [
-            "virtomate",
+        result = run_virtomate(
             "guest-run",
             running_vm_for_class,
             "--",
@@ -854,10 +889,9 @@ class TestGuestRun:
             "bash",
             "-c",
             'printf "Hello World" | wc -m',
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        )
         assert result.returncode == 0, "guest-run failed unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "exit_code": 0,
             "signal": None,
             "stdout": "11\n",  # len("Hello World")
@@ -867,13 +901,14 @@ class TestGuestRun:
         }
         assert result.stderr == ""
 
-    def test_empty_output(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
+    def test_empty_output(
+        self, conn_for_session: virConnect, running_vm_for_class: str
+    ) -> None:
+        wait_until_running(conn_for_session, running_vm_for_class)
 
-        cmd = ["virtomate", "guest-run", running_vm_for_class, "--", "true"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("guest-run", running_vm_for_class, "--", "true")
         assert result.returncode == 0, "guest-run failed unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "exit_code": 0,
             "signal": None,
             "stdout": None,
@@ -883,11 +918,12 @@ class TestGuestRun:
         }
         assert result.stderr == ""
 
-    def test_stdout_and_stderr(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
+    def test_stdout_and_stderr(
+        self, conn_for_session: virConnect, running_vm_for_class: str
+    ) -> None:
+        wait_until_running(conn_for_session, running_vm_for_class)
 
-        cmd = [
-            "virtomate",
+        result = run_virtomate(
             "guest-run",
             running_vm_for_class,
             "--",
@@ -895,10 +931,9 @@ class TestGuestRun:
             "bash",
             "-c",
             "printf 'out' ; printf 'err' 1>&2",
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        )
         assert result.returncode == 0, "guest-run failed unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "exit_code": 0,
             "signal": None,
             "stdout": "out",
@@ -908,26 +943,22 @@ class TestGuestRun:
         }
         assert result.stderr == ""
 
-    def test_stdin(self, running_vm_for_class: str) -> None:
-        wait_until_running(running_vm_for_class)
+    def test_stdin(
+        self, conn_for_session: virConnect, running_vm_for_class: str
+    ) -> None:
+        wait_until_running(conn_for_session, running_vm_for_class)
 
-        cmd = [
-            "virtomate",
+        result = run_virtomate(
             "guest-run",
             running_vm_for_class,
             "--stdin",
             "--",
             "wc",
             "-m",
-        ]
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
             input="Hello World",
         )
         assert result.returncode == 0, "guest-run failed unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "exit_code": 0,
             "signal": None,
             "stdout": "11\n",
@@ -940,22 +971,20 @@ class TestGuestRun:
 
 class TestVolumeList:
     def test_list_nonexistent_pool(self) -> None:
-        cmd = ["virtomate", "volume-list", "does-not-exist"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("volume-list", "does-not-exist")
         assert result.returncode == 1, "volume-list succeeded unexpectedly"
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "NotFoundError",
             "message": "Pool 'does-not-exist' does not exist",
         }
         assert result.stderr == ""
 
     def test_list(self) -> None:
-        cmd = ["virtomate", "volume-list", "default"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_virtomate("volume-list", "default")
         assert result.returncode == 0, "Could not list volumes of pool default"
         assert result.stderr == ""
 
-        volumes = json.loads(result.stdout)
+        volumes = _loads(result.stdout)
 
         # Filter the volumes in case there are others in the storage pool.
         expected_names = ("simple-bios", "simple-uefi", "simple-uefi-efivars.fd")
@@ -1004,22 +1033,32 @@ class TestVolumeList:
         ]
 
 
+@pytest.fixture
+def unique_raw_volume_name() -> str:
+    return "virtomate-raw-" + os.urandom(5).hex()
+
+
+@pytest.fixture
+def unique_qcow2_volume_name() -> str:
+    return "virtomate-qcow2-" + os.urandom(5).hex()
+
+
 class TestVolumeImport:
     def test_error_if_volume_does_not_exist(
-        self, tmp_path: pathlib.Path, after_function_cleanup: None
+        self,
+        tmp_path: pathlib.Path,
+        unique_raw_volume_name: str,
+        after_function_cleanup: None,
     ) -> None:
-        volume_name = "virtomate-raw-" + "".join(
-            random.choices(string.ascii_letters, k=10)
-        )
+        volume_name = unique_raw_volume_name
         volume_path = tmp_path.joinpath(volume_name)
 
         volumes = list_virtomate_volumes("default")
         assert volumes == []
 
-        cmd = ["virtomate", "volume-import", str(volume_path), "default"]
-        result = subprocess.run(cmd, text=True, capture_output=True)
+        result = run_virtomate("volume-import", str(volume_path), "default")
         assert result.returncode == 1
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "FileNotFoundError",
             "message": f"File '{volume_path}' does not exist",
         }
@@ -1030,21 +1069,21 @@ class TestVolumeImport:
         assert volumes == []
 
     def test_error_if_volume_is_not_a_file(
-        self, tmp_path: pathlib.Path, after_function_cleanup: None
+        self,
+        tmp_path: pathlib.Path,
+        unique_raw_volume_name: str,
+        after_function_cleanup: None,
     ) -> None:
-        volume_name = "virtomate-raw-" + "".join(
-            random.choices(string.ascii_letters, k=10)
-        )
+        volume_name = unique_raw_volume_name
         volume_path = tmp_path.joinpath(volume_name)
         volume_path.mkdir()
 
         volumes = list_virtomate_volumes("default")
         assert volumes == []
 
-        cmd = ["virtomate", "volume-import", str(volume_path), "default"]
-        result = subprocess.run(cmd, text=True, capture_output=True)
+        result = run_virtomate("volume-import", str(volume_path), "default")
         assert result.returncode == 1
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "ValueError",
             "message": f"Cannot import '{volume_path}' because it is not a file",
         }
@@ -1055,41 +1094,26 @@ class TestVolumeImport:
         assert volumes == []
 
     def test_error_if_volume_already_exists(
-        self, tmp_path: pathlib.Path, after_function_cleanup: None
+        self,
+        tmp_path: pathlib.Path,
+        unique_raw_volume_name: str,
+        after_function_cleanup: None,
+        virsh: Virsh,
     ) -> None:
-        volume_name = "virtomate-raw-" + "".join(
-            random.choices(string.ascii_letters, k=10)
-        )
+        volume_name = unique_raw_volume_name
         volume_path = tmp_path.joinpath(volume_name)
 
-        cmd = ["qemu-img", "create", "-f", "raw", str(volume_path), "1G"]
-        subprocess.run(cmd, check=True)
+        create_raw_image(volume_path, 1 << 30)
 
         # Create a volume with the same name as the one we are going to import to induce a collision.
-        cmd = ["virsh", "vol-create-as", "default", volume_name, "0"]
-        subprocess.run(cmd, check=True)
+        virsh.vol_create_as("default", volume_name, 0)
 
         volumes = list_virtomate_volumes("default")
-        assert volumes == [
-            {
-                "allocation": 0,
-                "backing_store": None,
-                "capacity": 0,
-                "key": "/var/lib/libvirt/images/" + volume_name,
-                "name": volume_name,
-                "physical": None,
-                "target": {
-                    "format_type": "raw",
-                    "path": "/var/lib/libvirt/images/" + volume_name,
-                },
-                "type": "file",
-            }
-        ]
+        assert volumes == [empty_raw_volume(volume_name)]
 
-        cmd = ["virtomate", "volume-import", str(volume_path), "default"]
-        result = subprocess.run(cmd, text=True, capture_output=True)
+        result = run_virtomate("volume-import", str(volume_path), "default")
         assert result.returncode == 1
-        assert json.loads(result.stdout) == {
+        assert _loads(result.stdout) == {
             "type": "Conflict",
             "message": f"Volume '{volume_name}' already exists in pool 'default'",
         }
@@ -1097,38 +1121,24 @@ class TestVolumeImport:
 
         # Ensure that the original volume is still there and has not been tampered with.
         volumes = list_virtomate_volumes("default")
-        assert volumes == [
-            {
-                "allocation": 0,
-                "backing_store": None,
-                "capacity": 0,
-                "key": "/var/lib/libvirt/images/" + volume_name,
-                "name": volume_name,
-                "physical": None,
-                "target": {
-                    "format_type": "raw",
-                    "path": "/var/lib/libvirt/images/" + volume_name,
-                },
-                "type": "file",
-            }
-        ]
+        assert volumes == [empty_raw_volume(volume_name)]
 
     def test_import_qcow2(
-        self, tmp_path: pathlib.Path, after_function_cleanup: None
+        self,
+        tmp_path: pathlib.Path,
+        unique_qcow2_volume_name: str,
+        after_function_cleanup: None,
     ) -> None:
-        volume_name = "virtomate-qcow2-" + "".join(
-            random.choices(string.ascii_letters, k=10)
-        )
+        volume_name = unique_qcow2_volume_name
         volume_path = tmp_path.joinpath(volume_name)
 
         cmd = ["qemu-img", "create", "-f", "qcow2", str(volume_path), "1G"]
-        subprocess.run(cmd, check=True)
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
 
         volumes = list_virtomate_volumes("default")
         assert volumes == []
 
-        cmd = ["virtomate", "volume-import", str(volume_path), "default"]
-        result = subprocess.run(cmd, text=True, capture_output=True)
+        result = run_virtomate("volume-import", str(volume_path), "default")
         assert result.returncode == 0
         assert result.stdout == ""
         assert result.stderr == ""
@@ -1151,22 +1161,21 @@ class TestVolumeImport:
         ]
 
     def test_import_raw(
-        self, tmp_path: pathlib.Path, after_function_cleanup: None
+        self,
+        tmp_path: pathlib.Path,
+        unique_raw_volume_name: str,
+        after_function_cleanup: None,
     ) -> None:
-        volume_name = "virtomate-raw-" + "".join(
-            random.choices(string.ascii_letters, k=10)
-        )
+        volume_name = unique_raw_volume_name
         volume_path = tmp_path.joinpath(volume_name)
 
-        # Volume is sparse by default. Disk size is only a couple of kilobytes.
-        cmd = ["qemu-img", "create", "-f", "raw", str(volume_path), "1G"]
-        subprocess.run(cmd, check=True)
+        # Volume is sparse. Disk size is only a couple of kilobytes.
+        create_raw_image(volume_path, 1 << 30)
 
         volumes = list_virtomate_volumes("default")
         assert volumes == []
 
-        cmd = ["virtomate", "volume-import", str(volume_path), "default"]
-        result = subprocess.run(cmd, text=True, capture_output=True)
+        result = run_virtomate("volume-import", str(volume_path), "default")
         assert result.returncode == 0
         assert result.stdout == ""
         assert result.stderr == ""
@@ -1189,27 +1198,23 @@ class TestVolumeImport:
         ]
 
     def test_import_with_rename(
-        self, tmp_path: pathlib.Path, after_function_cleanup: None
+        self,
+        tmp_path: pathlib.Path,
+        unique_qcow2_volume_name: str,
+        after_function_cleanup: None,
     ) -> None:
-        volume_name = "virtomate-qcow2-" + "".join(
-            random.choices(string.ascii_letters, k=10)
-        )
+        volume_name = unique_qcow2_volume_name
         volume_path = tmp_path.joinpath(volume_name)
 
         cmd = ["qemu-img", "create", "-f", "qcow2", str(volume_path), "1G"]
-        subprocess.run(cmd, check=True)
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
 
         volumes = list_virtomate_volumes("default")
         assert volumes == []
 
-        cmd = [
-            "virtomate",
-            "volume-import",
-            str(volume_path),
-            "default",
-            "virtomate-renamed",
-        ]
-        result = subprocess.run(cmd, text=True, capture_output=True)
+        result = run_virtomate(
+            "volume-import", str(volume_path), "default", "virtomate-renamed"
+        )
         assert result.returncode == 0
         assert result.stdout == ""
         assert result.stderr == ""
@@ -0,0 +1,39 @@
+"""Equivalents of the ``virsh`` commands used by the functional tests."""
+
+from xml.etree import ElementTree
+
+from libvirt import virConnect
+
+
+class Virsh:
+    """Performs the equivalent of selected ``virsh`` commands through an existing libvirt connection. Unlike invoking
+    ``virsh``, this spares starting a process and connecting to libvirt for every command."""
+
+    _conn: virConnect
+
+    def __init__(self, conn: virConnect):
+        self._conn = conn
+
+    def start(self, name: str) -> None:
+        """Equivalent of ``virsh start <name>``."""
+        domain = self._conn.lookupByName(name)
+        domain.create()
+
+    def vol_create_as(self, pool: str, name: str, capacity: int) -> None:
+        """Equivalent of ``virsh vol-create-as <pool> <name> <capacity>``."""
+        volume_tag = ElementTree.Element("volume")
+        name_tag = ElementTree.SubElement(volume_tag, "name")
+        name_tag.text = name
+        capacity_tag = ElementTree.SubElement(volume_tag, "capacity", {"unit": "bytes"})
+        capacity_tag.text = str(capacity)
+        volume_xml = ElementTree.tostring(volume_tag, encoding="unicode")
+
+        storage_pool = self._conn.storagePoolLookupByName(pool)
+        storage_pool.createXML(volume_xml, 0)
+
+    def vol_dumpxml(self, pool: str, name: str) -> str:
+        """Equivalent of ``virsh vol-dumpxml --pool <pool> <name>``."""
+        storage_pool = self._conn.storagePoolLookupByName(pool)
+        volume = storage_pool.storageVolLookupByName(name)
+        xml: str = volume.XMLDesc(0)
+        return xml
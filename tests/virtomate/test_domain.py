@@ -152,10 +152,28 @@ class TestCloneDomain:
             clone_domain(test_connection, "does-not-exist", "my-clone")
 
 
+# Smallest domain that occupies the UUID and MAC address that the factories generate first when seeded with 37.
+_COLLIDING_DOMAIN_XML = """
+<domain type="test">
+    <name>virtomate-colliding</name>
+    <uuid>ef70b4c0-1773-44a3-9b95-f239ae97d9db</uuid>
+    <memory unit="KiB">8192</memory>
+    <os>
+        <type>hvm</type>
+    </os>
+    <devices>
+        <interface type="network">
+            <mac address="52:54:00:2e:12:bd"/>
+            <source network="default"/>
+        </interface>
+    </devices>
+</domain>
+"""
+
+
 class TestLibvirtUUIDFactory:
     def test_create(self, test_connection: virConnect) -> None:
-        rnd = Random()
-        rnd.seed(37)
+        rnd = Random(37)
 
         uuid_factory = LibvirtUUIDFactory(test_connection, rnd=rnd)
 
@@ -163,10 +181,9 @@ class TestLibvirtUUIDFactory:
         assert uuid_factory.create() == UUID(hex="bf2eb110-d788-4003-aa59-ce1e9e293641")
 
     def test_create_collision_avoidance(self, test_connection: virConnect) -> None:
-        rnd = Random()
-        rnd.seed(37)
+        rnd = Random(37)
 
-        test_connection.defineXML(fixture("simple-uefi.xml"))
+        test_connection.defineXML(_COLLIDING_DOMAIN_XML)
         uuid_factory = LibvirtUUIDFactory(test_connection, rnd=rnd)
 
         assert uuid_factory.create() == UUID(hex="bf2eb110-d788-4003-aa59-ce1e9e293641")
@@ -175,8 +192,7 @@ class TestLibvirtUUIDFactory:
 
 class TestLibvirtMACFactory:
     def test_create_from(self, test_connection: virConnect) -> None:
-        rnd = Random()
-        rnd.seed(37)
+        rnd = Random(37)
 
         mac_factory = LibvirtMACFactory(test_connection, rnd=rnd)
 
@@ -195,10 +211,9 @@ class TestLibvirtMACFactory:
         assert str(excinfo.value) == "Invalid MAC address: z0:00:00:00:00:00"
 
     def test_create_from_collision_avoidance(self, test_connection: virConnect) -> None:
-        rnd = Random()
-        rnd.seed(37)
+        rnd = Random(37)
 
-        test_connection.defineXML(fixture("simple-uefi.xml"))
+        test_connection.defineXML(_COLLIDING_DOMAIN_XML)
         mac_factory = LibvirtMACFactory(test_connection, rnd=rnd)
 
         assert mac_factory.create_from("52:54:00:4c:4e:25") == "52:54:00:e0:37:e9"
@@ -254,69 +269,71 @@ class TestSourceVolume:
 
 
 class TestCloneOperation:
-    def test_clone_config_simple_bios_copy(self) -> None:
-        name = "virtomate-clone-copy"
-        config = ElementTree.fromstring(fixture("simple-bios.xml"))
-        clone_config = ElementTree.fromstring(expectation("clone-copy-simple-bios.xml"))
-        mac_factory = FixedMACFactory("52:54:00:4c:4e:25")
-        uuid_factory = FixedUUIDFactory(
-            UUID(hex="e5a8d70e-0cb5-49af-bf66-59c13180e344")
-        )
-
-        op = CloneOperation(config, name, CloneMode.COPY, uuid_factory, mac_factory)
-
-        assert op.clone_config() == ElementTree.tostring(
-            clone_config, encoding="unicode"
-        )
-
-    def test_clone_config_simple_bios_linked(self) -> None:
-        name = "virtomate-clone-linked"
-        config = ElementTree.fromstring(fixture("simple-bios-raw.xml"))
-        clone_config = ElementTree.fromstring(
-            expectation("clone-linked-simple-bios-raw.xml")
-        )
-        mac_factory = FixedMACFactory("52:54:00:9a:e6:0e")
-        uuid_factory = FixedUUIDFactory(
-            UUID(hex="ee309161-8e9b-4227-a0b0-f430f82d1437")
-        )
-
-        op = CloneOperation(config, name, CloneMode.LINKED, uuid_factory, mac_factory)
-
-        assert op.clone_config() == ElementTree.tostring(
-            clone_config, encoding="unicode"
-        )
-
-    def test_clone_config_simple_bios_reflink(self) -> None:
-        name = "virtomate-clone-reflink"
-        config = ElementTree.fromstring(fixture("simple-bios-raw.xml"))
-        clone_config = ElementTree.fromstring(
-            expectation("clone-reflink-simple-bios-raw.xml")
-        )
-        mac_factory = FixedMACFactory("52:54:00:ce:35:01")
-        uuid_factory = FixedUUIDFactory(
-            UUID(hex="0496dcd3-4c1f-4508-a3f3-a0d2be788848")
-        )
-
-        op = CloneOperation(config, name, CloneMode.REFLINK, uuid_factory, mac_factory)
-
-        assert op.clone_config() == ElementTree.tostring(
-            clone_config, encoding="unicode"
-        )
-
-    def test_clone_config_simple_uefi_copy(self) -> None:
-        name = "virtomate-clone-copy"
-        config = ElementTree.fromstring(fixture("simple-uefi.xml"))
-        clone_config = ElementTree.fromstring(expectation("clone-copy-simple-uefi.xml"))
-        mac_factory = FixedMACFactory("52:54:00:6c:91:a2")
-        uuid_factory = FixedUUIDFactory(
-            UUID(hex="70d6b969-6a1f-47f8-ab69-38cc33d000ea")
-        )
-
-        op = CloneOperation(config, name, CloneMode.COPY, uuid_factory, mac_factory)
-
-        assert op.clone_config() == ElementTree.tostring(
-            clone_config, encoding="unicode"
+    @pytest.mark.parametrize(
+        "name,fixture_name,expectation_name,mode,mac,uuid",
+        [
+            (
+                "virtomate-clone-copy",
+                "simple-bios.xml",
+                "clone-copy-simple-bios.xml",
+                CloneMode.COPY,
+                "52:54:00:4c:4e:25",
+                "e5a8d70e-0cb5-49af-bf66-59c13180e344",
+            ),
+            (
+                "virtomate-clone-linked",
+                "simple-bios-raw.xml",
+                "clone-linked-simple-bios-raw.xml",
+                CloneMode.LINKED,
+                "52:54:00:9a:e6:0e",
+                "ee309161-8e9b-4227-a0b0-f430f82d1437",
+            ),
+            (
+                "virtomate-clone-reflink",
+                "simple-bios-raw.xml",
+                "clone-reflink-simple-bios-raw.xml",
+                CloneMode.REFLINK,
+                "52:54:00:ce:35:01",
+                "0496dcd3-4c1f-4508-a3f3-a0d2be788848",
+            ),
+            (
+                "virtomate-clone-copy",
+                "simple-uefi.xml",
+                "clone-copy-simple-uefi.xml",
+                CloneMode.COPY,
+                "52:54:00:6c:91:a2",
+                "70d6b969-6a1f-47f8-ab69-38cc33d000ea",
+            ),
+        ],
+        ids=[
+            "simple-bios-copy",
+            "simple-bios-linked",
+            "simple-bios-reflink",
+            "simple-uefi-copy",
+        ],
+    )
+    def test_clone_config(
+        self,
+        name: str,
+        fixture_name: str,
+        expectation_name: str,
+        mode: CloneMode,
+        mac: str,
+        uuid: str,
+    ) -> None:
+        config = ElementTree.fromstring(fixture(fixture_name))
+        mac_factory = FixedMACFactory(mac)
+        uuid_factory = FixedUUIDFactory(UUID(hex=uuid))
+
+        op = CloneOperation(config, name, mode, uuid_factory, mac_factory)
+
+        # ElementTree names namespace prefixes ns0, ns1, etc. when serialising. Rewrite the prefixes on both sides
+        # so that only the structure and contents of the documents are compared.
+        actual = ElementTree.canonicalize(op.clone_config(), rewrite_prefixes=True)
+        expected = ElementTree.canonicalize(
+            expectation(expectation_name), rewrite_prefixes=True
         )
+        assert actual == expected
 
 
 class TestDomainExists: